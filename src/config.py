@@ -33,6 +33,10 @@ TIME_SHIFT_MAP = {
     8: 8.0
 }
 
+# Duration classes (in quarterLength) of the pitch/duration events written by
+# preprocess.py and decoded by generate.py
+DURATION_CLASSES = (0.25, 0.5, 1.0, 2.0, 4.0)
+
 # Model hyperparameters
 LSTM_UNITS_1 = 256
 LSTM_UNITS_2 = 128
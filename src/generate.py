@@ -5,27 +5,28 @@ import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 
-from music21 import stream, instrument, note, chord, tempo, meter
+from music21 import stream, instrument, note, tempo, meter
+
+from config import DURATION_CLASSES
 
 PROJECT_DIR = Path(__file__).parent.parent
 MODELS_DIR = PROJECT_DIR / "models" / "music_vae"
 GENERATED_DIR = PROJECT_DIR / "data" / "generated"
 
-DURATION_MAP = {
-    0: 0.25,
-    1: 0.5,
-    2: 1.0,
-    3: 2.0,
-    4: 4.0
-}
+# Allocate GPU memory on demand instead of reserving all VRAM at import time
+for gpu in tf.config.list_physical_devices('GPU'):
+    tf.config.experimental.set_memory_growth(gpu, True)
+
+DURATION_MAP = dict(enumerate(DURATION_CLASSES))
 
 
 def find_latest_model(model_dir: str = None) -> str:
     """
     Find the latest trained model in the models directory.
     
-    Searches for best_model.h5 first (checkpoint with best validation loss),
-    then falls back to model_final.h5 (final trained model).
+    Searches for best_model.keras first (checkpoint with best validation loss),
+    then falls back to model_final.keras (final trained model). Models
+    trained before the switch to the .keras format (.h5) are still found.
     
     Args:
         model_dir: Directory containing models. Defaults to MODELS_DIR if None.
@@ -36,31 +37,117 @@ def find_latest_model(model_dir: str = None) -> str:
     if model_dir is None:
         model_dir = str(MODELS_DIR)
     
-    best_model_path = os.path.join(model_dir, "best_model.h5")
-    if os.path.exists(best_model_path):
-        return best_model_path
-    
-    final_model_path = os.path.join(model_dir, "model_final.h5")
-    if os.path.exists(final_model_path):
-        return final_model_path
+    for extension in (".keras", ".h5"):
+        best_model_path = os.path.join(model_dir, "best_model" + extension)
+        if os.path.exists(best_model_path):
+            return best_model_path
+        
+        final_model_path = os.path.join(model_dir, "model_final" + extension)
+        if os.path.exists(final_model_path):
+            return final_model_path
     
     print(f"no model found in {model_dir}")
     return None
 
 
-def load_model(model_path: str) -> keras.Model:
+class InferenceModule(tf.Module):
+    """
+    Wraps a Keras model in a single traced inference function.
+    
+    Exported as a SavedModel, the traced graph can be restored with
+    tf.saved_model.load without rebuilding the Keras layers.
+    """
+    
+    def __init__(self, model: keras.Model):
+        super().__init__()
+        self.model = model
+        # Keras 3 models are not traversed by tf.Module tracking: listing their
+        # variables (including the Dropout seed generator states the traced graph
+        # captures) makes them reachable from the exported root
+        self.model_variables = list(model.variables)
+        # recent models output raw logits; older ones end with a softmax
+        self.from_logits = [
+            getattr(model.get_layer(name).activation, "__name__", "") == "linear"
+            for name in model.output_names
+        ]
+    
+    @tf.function
+    def __call__(self, events):
+        # models trained on uint8 events take integer inputs; the exported
+        # signature stays float32 so callers do not depend on the model version
+        events = tf.cast(events, self.model.inputs[0].dtype)
+        outputs = self.model(events, training=False)
+        return [tf.nn.softmax(out) if logits else out
+                for out, logits in zip(outputs, self.from_logits)]
+
+
+def export_saved_model(model: keras.Model, export_dir: str) -> None:
     """
-    Load a trained Keras model from disk.
+    Export a Keras model as a SavedModel exposing a traced inference function.
     
     Args:
-        model_path: Path to the .h5 model file.
+        model: Trained Keras model taking (batch, sequence_length, 2) events.
+        export_dir: Directory where the SavedModel is written.
+    """
+    module = InferenceModule(model)
+    module.__call__.get_concrete_function(
+        tf.TensorSpec([None, model.input_shape[1], 2], tf.float32, name="events")
+    )
+    tf.saved_model.save(module, export_dir)
+
+
+def _is_up_to_date(path: str, reference: str) -> bool:
+    """Return True if path exists and is at least as recent as reference."""
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(reference)
+
+
+def load_model(model_path: str):
+    """
+    Load a trained model from disk as a ready-to-call inference function.
+    
+    The first load of a Keras file exports it next to the original as a
+    SavedModel (<name>_sm). Later loads restore that traced graph directly,
+    which skips Keras layer reconstruction. The export is refreshed whenever
+    the Keras file is newer. If the export fails, a <name>_sm.failed marker is
+    left so later loads of the same file go straight to the Keras model
+    instead of retracing and failing again.
+    
+    Args:
+        model_path: Path to the .keras (or legacy .h5) model file.
         
     Returns:
-        Loaded Keras model, or None if loading failed.
+        Callable mapping a (batch, sequence_length, 2) float32 array to the
+        [pitch, duration] probabilities, or None if loading failed.
     """
+    saved_model_dir = os.path.splitext(model_path)[0] + "_sm"
+    saved_model_pb = os.path.join(saved_model_dir, "saved_model.pb")
+    export_failed = saved_model_dir + ".failed"
+    
     try:
-        model = keras.models.load_model(model_path)
-        print(f"model loaded: {model_path}")
+        if not _is_up_to_date(saved_model_pb, model_path):
+            model = keras.models.load_model(model_path)
+            
+            if _is_up_to_date(export_failed, model_path):
+                print(f"model loaded: {model_path}")
+                return InferenceModule(model)
+            
+            try:
+                export_saved_model(model, saved_model_dir)
+                print(f"model exported: {saved_model_dir}")
+            except Exception as e:
+                print(f"error exporting model, using keras model: {e}")
+                try:
+                    Path(export_failed).touch()
+                except OSError:
+                    pass
+                print(f"model loaded: {model_path}")
+                return InferenceModule(model)
+            
+            if os.path.exists(export_failed):
+                os.remove(export_failed)
+        
+        model = tf.saved_model.load(saved_model_dir)
+        print(f"model loaded: {saved_model_dir}")
         return model
     except Exception as e:
         print(f"error loading model: {e}")
@@ -68,15 +155,26 @@ def load_model(model_path: str) -> keras.Model:
 
 
 def sample_with_temperature(predictions, temperature):
-    predictions = np.log(predictions + 1e-10) / temperature
-    predictions = np.exp(predictions) / np.sum(np.exp(predictions))
-    return np.random.choice(len(predictions), p=predictions)
+    """
+    Sample class indices from probability rows reweighted by temperature.
+    
+    Accepts a single distribution of shape (num_classes,) or a batch of
+    shape (batch, num_classes); one index is drawn per row.
+    """
+    predictions = np.log(np.asarray(predictions, dtype=np.float64) + 1e-10) / temperature
+    predictions = np.exp(predictions - predictions.max(axis=-1, keepdims=True))
+    predictions /= predictions.sum(axis=-1, keepdims=True)
+    
+    rows = np.atleast_2d(predictions)
+    draws = np.random.random((rows.shape[0], 1))
+    indices = np.minimum((rows.cumsum(axis=-1) < draws).sum(axis=-1), rows.shape[1] - 1)
+    return indices if predictions.ndim > 1 else int(indices[0])
 
 
-def generate_sequence(model: keras.Model,
+def generate_sequence(model,
                       seed_sequence: np.ndarray,
                       length: int = 128,
-                      temperature: float = 0.8) -> list:
+                      temperature: float = 0.8) -> np.ndarray:
     """
     Generate a sequence of music events using the trained model.
     
@@ -85,44 +183,52 @@ def generate_sequence(model: keras.Model,
     2. Sampling predictions for pitch and duration using temperature
     3. Repeating until target length is reached
     
+    A batch of seeds is generated in lockstep, one model call per step
+    for the whole batch.
+    
     The model outputs 2 values per event:
     - pitch: MIDI pitch (0-127, 128 = padding)
     - duration: duration class (0-4)
     
     Args:
-        model: Trained Keras model with 2 output heads (pitch, duration).
-        seed_sequence: Initial sequence of shape (sequence_length, 2).
+        model: Trained model as returned by load_model, with 2 outputs (pitch, duration).
+        seed_sequence: Initial sequence of shape (sequence_length, 2), or a
+            batch of seeds of shape (num_sequences, sequence_length, 2).
         length: Total target length of generated sequence.
         temperature: Sampling temperature (higher = more random, lower = more deterministic).
         
     Returns:
-        List of events, each event is a list of 2 integers [pitch, duration_class].
+        Array of shape (length, 2) with one [pitch, duration_class] row per event,
+        or (num_sequences, length, 2) when a batch of seeds was given.
     """
-    sequence_length = seed_sequence.shape[0]
-    generated = [list(event) for event in seed_sequence]
+    batched = seed_sequence.ndim == 3
+    seeds = seed_sequence if batched else seed_sequence[np.newaxis]
+    num_sequences, sequence_length = seeds.shape[:2]
+    num_steps = max(length - sequence_length, 0)
+    
+    context = np.array(seeds, dtype=np.float32)
+    generated = np.empty((num_sequences, sequence_length + num_steps, 2), dtype=np.int32)
+    generated[:, :sequence_length] = seeds
     
     print(f"\ngeneration of {length} events (temperature={temperature})...")
     
-    for i in range(length - sequence_length):
-        input_seq = np.array([generated[-sequence_length:]], dtype=np.float32)
-        
-        predictions = model.predict(input_seq, verbose=0)
-        
-        pitch_pred = predictions[0][0]
-        duration_pred = predictions[1][0]
-        
-        pitch = sample_with_temperature(pitch_pred, temperature)
-        pitch = np.clip(int(pitch), 0, 127)
+    for i in range(num_steps):
+        pitch_pred, duration_pred = model(context)
         
-        duration = sample_with_temperature(duration_pred, temperature)
-        duration = np.clip(int(duration), 0, 4)
+        pitch = np.clip(sample_with_temperature(pitch_pred, temperature), 0, 127)
+        duration = np.clip(sample_with_temperature(duration_pred, temperature), 0, 4)
         
-        generated.append([pitch, duration])
+        # shift the context window in place instead of rebuilding it from a list
+        context[:, :-1] = context[:, 1:]
+        context[:, -1, 0] = pitch
+        context[:, -1, 1] = duration
+        generated[:, sequence_length + i, 0] = pitch
+        generated[:, sequence_length + i, 1] = duration
         
         if (i + 1) % 32 == 0:
-            print(f"  {i + 1} / {length - sequence_length} events generated")
+            print(f"  {i + 1} / {num_steps} events generated")
     
-    return generated
+    return generated if batched else generated[0]
 
 
 def sequence_to_midi(events_sequence: list,
@@ -193,7 +299,7 @@ def sequence_to_midi(events_sequence: list,
         return False
 
 
-def create_random_seed_sequence(sequence_length: int = 32) -> np.ndarray:
+def create_random_seed_sequence(sequence_length: int = 32, num_samples: int = None) -> np.ndarray:
     """
     Create a random seed sequence for generation.
     
@@ -202,18 +308,20 @@ def create_random_seed_sequence(sequence_length: int = 32) -> np.ndarray:
     
     Args:
         sequence_length: Number of events to generate for seed.
+        num_samples: Number of independent seeds to draw at once. None
+            returns a single seed.
         
     Returns:
-        Array of shape (sequence_length, 2) with random events [pitch, duration].
+        Array of shape (sequence_length, 2) with random events [pitch, duration],
+        or (num_samples, sequence_length, 2) when num_samples is given.
     """
-    seed = []
+    shape = (sequence_length,) if num_samples is None else (num_samples, sequence_length)
     
-    for i in range(sequence_length):
-        pitch = np.random.randint(50, 80)
-        duration = np.random.randint(0, 5)
-        seed.append([pitch, duration])
+    seed = np.empty(shape + (2,), dtype=np.float32)
+    seed[..., 0] = np.random.randint(50, 80, size=shape)
+    seed[..., 1] = np.random.randint(0, 5, size=shape)
     
-    return np.array(seed, dtype=np.float32)
+    return seed
 
 
 def generate_and_save(model_path: str,
@@ -248,13 +356,11 @@ def generate_and_save(model_path: str,
     print(f"   - temperature: {temperature}")
     print(f"   - files to generate: {num_samples}")
     
-    for i in range(num_samples):
-        print(f"\n[{i+1}/{num_samples}] generation of file {i+1}...")
-        
-        seed = create_random_seed_sequence(32)
-        
-        sequence = generate_sequence(model, seed, num_events, temperature)
-        
+    print(f"\ngeneration of {num_samples} files in one batch...")
+    seeds = create_random_seed_sequence(32, num_samples=num_samples)
+    sequences = generate_sequence(model, seeds, num_events, temperature)
+    
+    for i, sequence in enumerate(sequences):
         output_filename = f"generated_music_{i+1:03d}.mid"
         output_path = os.path.join(output_dir, output_filename)
         
@@ -1,15 +1,45 @@
 import os
-import glob
+import logging
 import argparse
+import hashlib
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from tqdm import tqdm
 import numpy as np
-import pickle
 
-from music21 import converter, instrument, note, chord
+import mido
+
+from config import DURATION_CLASSES
+
 PROJECT_DIR = Path(__file__).parent.parent
 DATA_DIR = PROJECT_DIR / "data"
 PROCESSED_DIR = PROJECT_DIR / "data" / "processed"
+CACHE_DIR = PROCESSED_DIR / "_cache"
+
+# à incrémenter quand l'extraction change: invalide tous les caches .npz
+EXTRACTOR_VERSION = 2
+
+# fichiers MIDI traités par tâche d'un worker (annoncés ensemble au noyau avant lecture)
+FILES_PER_TASK = 8
+
+# séquences copiées par tranche lors de l'écriture des splits (64 o par séquence de 32)
+SPLIT_CHUNK = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+# pitch 128 marque le padding (même convention que train.py / generate.py)
+PAD_PITCH = 128
+
+# une note lue dans une piste MIDI (temps en ticks)
+NOTE_DT = np.dtype([('pitch', np.int16), ('start', np.int64),
+                    ('end', np.int64), ('velocity', np.int16)])
+
+# plus petit pas des grilles de quantification (1/4 et 1/3 de noire), en quarterLength
+MIN_QUARTER_LENGTH = 0.25
+
+# seuils entre deux classes consécutives (milieux à x1.5)
+_DURATION_BOUNDS = np.array(DURATION_CLASSES[:-1]) * 1.5
 
 
 def collect_midi_files(data_dir: str, max_files: int = 10) -> list:
@@ -17,14 +47,11 @@ def collect_midi_files(data_dir: str, max_files: int = 10) -> list:
     data_dir: chemin vers le dossier contenant les fichiers MIDI
     max_files: nombre maximum de fichiers à traiter (None = tous les fichiers)
     """
-    midi_patterns = ['**/*.midi', '**/*.mid', '**/*.MIDI', '**/*.MID']
-    midi_files = []
-    
-    for pattern in midi_patterns:
-        midi_files.extend(glob.glob(os.path.join(data_dir, pattern), recursive=True))
-    
-    # Supprimer les doublons
-    midi_files = list(set(midi_files))
+    # un seul parcours de l'arborescence, extension filtrée sans tenir compte de la casse
+    midi_files = [os.path.join(root, name)
+                  for root, _, names in os.walk(data_dir)
+                  for name in names if name.lower().endswith(('.mid', '.midi'))]
+    midi_files.sort()
     
     if max_files is not None:
         midi_files = midi_files[:max_files]
@@ -35,66 +62,255 @@ def collect_midi_files(data_dir: str, max_files: int = 10) -> list:
     return midi_files
 
 
-def extract_notes_from_midi(midi_path: str) -> list:
+def _advise_willneed(paths: list):
+    """
+    paths: fichiers qui vont être lus
+    Demande au noyau (POSIX_FADV_WILLNEED) de commencer à les charger: la lecture
+    des suivants se fait pendant l'analyse du premier.
+    """
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def quantize_quarter_lengths(values: np.ndarray) -> np.ndarray:
+    """
+    values: positions ou durées en quarterLength
+    Aligne sur la grille la plus proche entre 1/4 et 1/3 de noire, comme le
+    quantizePost par défaut de music21.
+    """
+    by_four = np.round(values * 4) / 4
+    by_three = np.round(values * 3) / 3
+    # à égale distance (ex. 29/12), la grille 1/4 l'emporte comme dans music21; la marge
+    # absorbe l'erreur d'arrondi flottant entre les deux distances
+    return np.where(np.abs(values - by_four) <= np.abs(values - by_three) + 1e-9, by_four, by_three)
+
+
+def _read_track_notes(track) -> np.ndarray:
+    """
+    track: piste mido
+    Apparie les note_on/note_off d'une piste et retourne un tableau structuré
+    NOTE_DT (pitch, start, end, velocity), temps en ticks absolus.
+    """
+    rows = []
+    active = {}
+    tick = 0
+    
+    for msg in track:
+        tick += msg.time
+        # canal 10 = percussions, ignorées comme avec music21
+        if msg.type not in ('note_on', 'note_off') or msg.channel == 9:
+            continue
+        key = (msg.channel, msg.note)
+        if msg.type == 'note_on' and msg.velocity > 0:
+            active.setdefault(key, []).append((tick, msg.velocity))
+        elif active.get(key):
+            start, velocity = active[key].pop(0)
+            rows.append((msg.note, start, tick, velocity))
+    
+    # une seule conversion pour toute la piste
+    return np.array(rows, dtype=NOTE_DT)
+
+
+def _empty_notes() -> tuple:
+    return (np.empty(0, dtype=np.int16), np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int16))
+
+
+def _chord_leaders(starts: np.ndarray, ends: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    starts: débuts des notes en ticks, triés
+    ends: fins des notes en ticks
+    tolerance: écart maximal (exclu) en ticks entre les débuts d'un même accord
+    Regroupe les notes comme midiTrackToStream de music21: une note non encore
+    regroupée ouvre un accord qui absorbe les notes suivantes commençant à moins de
+    tolerance d'elle et finissant à tolerance près. Retourne le masque des notes
+    qui ouvrent un accord (ou restent seules).
+    """
+    leaders = np.zeros(len(starts), dtype=bool)
+    gathered = np.zeros(len(starts), dtype=bool)
+    window_ends = np.searchsorted(starts, starts + tolerance)
+    
+    for i in range(len(starts)):
+        if gathered[i]:
+            continue
+        leaders[i] = True
+        stop = window_ends[i]
+        gathered[i + 1:stop] |= np.abs(ends[i + 1:stop] - ends[i]) <= tolerance
+    
+    return leaders
+
+
+def _parse_midi(midi_path: str) -> tuple:
     """
     midi_path: chemin vers le fichier MIDI
+    Retourne les colonnes (pitches, offsets, durations, velocities) en tableaux numpy,
+    offsets et durées en quarterLength. Les notes de chaque piste sont regroupées en
+    accords (voir _chord_leaders), chacun réduit à sa première note jouée (comme
+    pitches[0] avec music21). Retourne None si le fichier est illisible.
     """
+    columns = []
+    
     try:
-        score = converter.parse(midi_path)
-        notes_list = []
+        midi = mido.MidiFile(midi_path)
+        # tolérance en ticks du regroupement en accord: le plus petit pas de la grille
+        tolerance = midi.ticks_per_beat * MIN_QUARTER_LENGTH
         
-        for element in score.recurse().notesAndRests:
-            if isinstance(element, note.Note):
-                notes_list.append({
-                    'pitch': element.pitch.midi,
-                    'offset': element.offset,
-                    'duration': element.quarterLength,
-                    'velocity': getattr(element.volume, 'velocity', 64)
-                })
-            elif isinstance(element, chord.Chord):
-                notes_list.append({
-                    'pitch': element.pitches[0].midi,
-                    'offset': element.offset,
-                    'duration': element.quarterLength,
-                    'velocity': getattr(element.volume, 'velocity', 64)
-                })
-        
-        return notes_list
-    except Exception as e:
-        print(f"error reading {midi_path}: {e}")
-        return []
+        for track in midi.tracks:
+            notes = _read_track_notes(track)
+            if len(notes) == 0:
+                continue
+            notes = notes[np.lexsort((notes['pitch'], notes['start']))]
+            
+            notes = notes[_chord_leaders(notes['start'], notes['end'], tolerance)]
+            
+            offsets = quantize_quarter_lengths(notes['start'] / midi.ticks_per_beat)
+            durations = quantize_quarter_lengths((notes['end'] - notes['start']) / midi.ticks_per_beat)
+            
+            columns.append((notes['pitch'],
+                            offsets,
+                            # une note très courte ne doit pas être quantisée à une durée nulle
+                            np.maximum(durations, MIN_QUARTER_LENGTH),
+                            notes['velocity']))
+    except Exception:
+        logger.exception("error reading %s", midi_path)
+        return None
+    
+    if not columns:
+        return _empty_notes()
+    
+    return tuple(np.concatenate(column) for column in zip(*columns))
+
+
+def _cache_path(midi_path: str, cache_dir) -> Path:
+    """
+    midi_path: chemin vers le fichier MIDI
+    cache_dir: dossier du cache
+    """
+    key = hashlib.blake2b(os.path.abspath(midi_path).encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"{key}.npz"
+
+
+def _cache_is_fresh(midi_path: str, cache: Path) -> bool:
+    """
+    midi_path: chemin vers le fichier MIDI
+    cache: fichier .npz correspondant
+    Vrai si le cache existe et est plus récent que le fichier MIDI (la version
+    de l'extracteur est vérifiée à la lecture).
+    """
+    try:
+        return os.path.getmtime(cache) >= os.path.getmtime(midi_path)
+    except OSError:
+        return False
+
+
+def extract_notes_from_midi(midi_path: str, cache_dir=CACHE_DIR) -> tuple:
+    """
+    midi_path: chemin vers le fichier MIDI
+    cache_dir: dossier du cache .npz (None = pas de cache)
+    Comme _parse_midi, mais réutilise le résultat mis en cache si le fichier MIDI
+    n'a pas changé depuis et que EXTRACTOR_VERSION est la même.
+    """
+    if cache_dir is None:
+        return _parse_midi(midi_path) or _empty_notes()
+    
+    cache = _cache_path(midi_path, cache_dir)
+    try:
+        if _cache_is_fresh(midi_path, cache):
+            with np.load(cache) as cached:
+                if int(cached['version']) == EXTRACTOR_VERSION:
+                    return (cached['pitches'], cached['offsets'],
+                            cached['durations'], cached['velocities'])
+    except Exception:
+        logger.warning("ignoring unreadable cache %s", cache)
+    
+    notes = _parse_midi(midi_path)
+    if notes is None:
+        # fichier illisible: pas mis en cache pour retenter au prochain lancement
+        return _empty_notes()
+    
+    try:
+        os.makedirs(cache.parent, exist_ok=True)
+        pitches, offsets, durations, velocities = notes
+        np.savez_compressed(cache, pitches=pitches, offsets=offsets, durations=durations,
+                            velocities=velocities, version=EXTRACTOR_VERSION)
+    except OSError:
+        logger.warning("could not write cache %s", cache)
+    
+    return notes
 
 
-def extract_sequences(notes_list: list, sequence_length: int = 32) -> list:
+def extract_notes_from_files(midi_paths: list, cache_dir=CACHE_DIR) -> list:
     """
-    notes_list: liste des notes extraites
+    midi_paths: lot de fichiers MIDI traités par un même worker
+    cache_dir: dossier du cache .npz (None = pas de cache)
+    Annonce au noyau les fichiers du lot qu'il faudra vraiment lire (cache absent
+    ou périmé), puis applique extract_notes_from_midi à chacun, dans l'ordre.
+    """
+    # posix_fadvise n'existe pas sous Windows / macOS: pas de préchargement
+    if hasattr(os, 'posix_fadvise'):
+        _advise_willneed([path for path in midi_paths
+                          if cache_dir is None or not _cache_is_fresh(path, _cache_path(path, cache_dir))])
+    
+    return [extract_notes_from_midi(path, cache_dir) for path in midi_paths]
+
+
+def build_events(pitches: np.ndarray, durations: np.ndarray) -> np.ndarray:
+    """
+    pitches: hauteurs des notes extraites
+    durations: durées des notes extraites (en quarterLength)
+    Construit en une passe le tableau d'événements (N, 2) [pitch, classe de durée],
+    directement au dtype de stockage (uint8).
+    Quantise la durée dans les classes de DURATION_CLASSES
+    """
+    events = np.empty((len(pitches), 2), dtype=np.uint8)
+    events[:, 0] = pitches
+    events[:, 1] = np.searchsorted(_DURATION_BOUNDS, durations, side='right')
+    return events
+
+
+def extract_sequences(events: np.ndarray, sequence_length: int = 32) -> np.ndarray:
+    """
+    events: tableau d'événements (N, 2) produit par build_events
     sequence_length: longueur de chaque séquence
-    Quantise la durée en 5 classes: [0.25, 0.5, 1.0, 2.0, 4.0]
-    """
-    def quantize_duration(duration):
-        if duration < 0.375:
-            return 0
-        elif duration < 0.75:
-            return 1
-        elif duration < 1.5:
-            return 2
-        elif duration < 3.0:
-            return 3
-        else:
-            return 4
-    
-    sequences = []
-    
-    if len(notes_list) < sequence_length:
-        pairs = [[n['pitch'], quantize_duration(n['duration'])] for n in notes_list]
-        pairs.extend([[-1, 0]] * (sequence_length - len(pairs)))
-        sequences.append(pairs)
-    else:
-        for i in range(len(notes_list) - sequence_length + 1):
-            sequence = [[n['pitch'], quantize_duration(n['duration'])] for n in notes_list[i:i+sequence_length]]
-            sequences.append(sequence)
+    Retourne un tableau (M, sequence_length, 2): les fenêtres glissantes sont des
+    vues sur events (aucune copie), ou une seule séquence complétée par du
+    padding si le fichier est trop court.
+    """
+    if len(events) < sequence_length:
+        padding = ((0, sequence_length - len(events)), (0, 0))
+        padded = np.pad(events, padding, constant_values=0)
+        padded[len(events):, 0] = PAD_PITCH
+        return padded[None]
     
-    return sequences
+    return np.lib.stride_tricks.sliding_window_view(events, sequence_length, axis=0).transpose(0, 2, 1)
+
+
+def write_split(sequences: np.ndarray, indices: np.ndarray, path: str, chunk_size: int = SPLIT_CHUNK):
+    """
+    sequences: corpus complet (mappé en mémoire)
+    indices: indices des séquences du split, dans l'ordre voulu
+    path: fichier .npy de sortie
+    chunk_size: nombre de séquences copiées à la fois
+    Écrit sequences[indices] directement dans un .npy mappé, par tranches:
+    la RAM utilisée reste bornée par chunk_size quelle que soit la taille du split.
+    """
+    split = np.lib.format.open_memmap(path, mode='w+', dtype=sequences.dtype,
+                                      shape=(len(indices),) + sequences.shape[1:])
+    try:
+        for start in range(0, len(indices), chunk_size):
+            split[start:start + chunk_size] = sequences[indices[start:start + chunk_size]]
+        split.flush()
+    finally:
+        del split
 
 
 def preprocess_dataset(data_dir: str, 
@@ -102,7 +318,9 @@ def preprocess_dataset(data_dir: str,
                        sequence_length: int = 32,
                        train_split: float = 0.9,
                        progress_callback=None,
-                       max_files: int = 10):
+                       max_files: int = 10,
+                       num_workers: int = None,
+                       seed: int = None):
     """
     data_dir: dossier contenant les fichiers MIDI
     output_dir: dossier de sortie pour les données prétraitées
@@ -110,6 +328,8 @@ def preprocess_dataset(data_dir: str,
     train_split: proportion pour l'entraînement (reste = validation)
     progress_callback: fonction appelée avec (progress: int, message: str)
     max_files: nombre maximum de fichiers à traiter
+    num_workers: nombre de processus pour lire les MIDI (None = os.cpu_count())
+    seed: graine du mélange train/validation (None = aléatoire)
     """
     def update_progress(progress, message):
         if progress_callback:
@@ -125,64 +345,90 @@ def preprocess_dataset(data_dir: str,
         update_progress(0, "Error: no midi files found!")
         return
     
-    all_sequences = []
+    all_events = []
     all_pitches = []
     
     print("\nprocessing midi files...")
     update_progress(10, f"Extracting notes from {len(midi_files)} MIDI files...")
-    for idx, midi_path in enumerate(midi_files):
-        notes_list = extract_notes_from_midi(midi_path)
-        
-        if len(notes_list) == 0:
-            continue
-        
-        sequences = extract_sequences(notes_list, sequence_length)
-        all_sequences.extend(sequences)
-        
-        all_pitches.extend([n['pitch'] for n in notes_list])
-        
-        progress = 10 + int((idx / len(midi_files)) * 50)
-        update_progress(progress, f"Processing file {idx + 1}/{len(midi_files)}: {os.path.basename(midi_path)}")
+    executor = ProcessPoolExecutor(max_workers=num_workers)
+    try:
+        # une tâche par lot de fichiers: le worker précharge son propre lot avant de le lire
+        extract = partial(extract_notes_from_files, cache_dir=os.path.join(output_dir, "_cache"))
+        tasks = [midi_files[i:i + FILES_PER_TASK] for i in range(0, len(midi_files), FILES_PER_TASK)]
+        notes_per_file = chain.from_iterable(executor.map(extract, tasks))
+        for idx, (midi_path, notes) in enumerate(zip(midi_files, notes_per_file)):
+            pitches, offsets, durations, velocities = notes
+            
+            if len(pitches) > 0:
+                all_events.append(build_events(pitches, durations))
+                all_pitches.append(pitches)
+            
+            progress = 10 + int((idx / len(midi_files)) * 50)
+            update_progress(progress, f"Processing file {idx + 1}/{len(midi_files)}: {os.path.basename(midi_path)}")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     
-    print(f"\ntotal: {len(all_sequences)} sequences created")
+    # une séquence par fenêtre, ou une seule (complétée) si le fichier est trop court
+    counts = [max(len(events) - sequence_length + 1, 1) for events in all_events]
+    total_sequences = sum(counts)
     
-    if len(all_sequences) == 0:
+    print(f"\ntotal: {total_sequences} sequences created")
+    
+    if total_sequences == 0:
         print("no valid sequences created!")
         update_progress(0, "Error: no valid sequences created!")
         return
     
-    update_progress(65, f"Converting {len(all_sequences)} sequences to numpy arrays...")
-    all_sequences = np.array(all_sequences, dtype=np.float32)
-    
-    update_progress(75, "Shuffling and splitting data...")
-    np.random.shuffle(all_sequences)
-    
-    split_idx = int(len(all_sequences) * train_split)
-    train_sequences = all_sequences[:split_idx]
-    val_sequences = all_sequences[split_idx:]
-    
-    update_progress(85, f"Saving {len(train_sequences)} training sequences...")
-    train_path = os.path.join(output_dir, "train_sequences.npy")
-    val_path = os.path.join(output_dir, "validation_sequences.npy")
-    
-    np.save(train_path, train_sequences)
-    np.save(val_path, val_sequences)
-    
-    print(f"training data: {train_path} (shape: {train_sequences.shape})")
-    print(f"validation data: {val_path} (shape: {val_sequences.shape})")
-    
-    update_progress(95, "Saving statistics...")
-    stats = {
-        "total_midi_files": len(midi_files),
-        "total_sequences": len(all_sequences),
-        "train_sequences": len(train_sequences),
-        "val_sequences": len(val_sequences),
-        "sequence_length": sequence_length,
-        "min_pitch": int(np.min(all_pitches)),
-        "max_pitch": int(np.max(all_pitches)),
-        "avg_pitch": float(np.mean(all_pitches)),
-        "total_notes": len(all_pitches)
-    }
+    update_progress(65, f"Building {total_sequences} sequences...")
+    # pitch <= 128 et classe de durée <= 4: uint8 suffit (4x plus léger que float32)
+    # le corpus est écrit dans un .npy mappé en mémoire: la RAM ne borne plus sa taille
+    all_path = os.path.join(output_dir, "all_sequences.npy")
+    all_sequences = np.lib.format.open_memmap(all_path, mode='w+', dtype=np.uint8,
+                                              shape=(total_sequences, sequence_length, 2))
+    try:
+        cursor = 0
+        for events, count in zip(all_events, counts):
+            all_sequences[cursor:cursor + count] = extract_sequences(events, sequence_length)
+            cursor += count
+        
+        update_progress(75, "Shuffling and splitting data...")
+        # on ne mélange que les indices: une seule lecture par séquence lors du gather
+        rng = np.random.default_rng(seed)
+        perm = rng.permutation(len(all_sequences))
+        
+        split_idx = int(len(all_sequences) * train_split)
+        train_indices = perm[:split_idx]
+        val_indices = perm[split_idx:]
+        
+        update_progress(85, f"Saving {len(train_indices)} training sequences...")
+        train_path = os.path.join(output_dir, "train_sequences.npy")
+        val_path = os.path.join(output_dir, "validation_sequences.npy")
+        
+        # gather par tranches vers des .npy mappés: le corpus n'est jamais copié en RAM
+        write_split(all_sequences, train_indices, train_path)
+        write_split(all_sequences, val_indices, val_path)
+        
+        print(f"training data: {train_path} (shape: {(len(train_indices),) + all_sequences.shape[1:]})")
+        print(f"validation data: {val_path} (shape: {(len(val_indices),) + all_sequences.shape[1:]})")
+        
+        update_progress(95, "Saving statistics...")
+        all_pitches = np.concatenate(all_pitches)
+        stats = {
+            "total_midi_files": len(midi_files),
+            "total_sequences": len(all_sequences),
+            "train_sequences": len(train_indices),
+            "val_sequences": len(val_indices),
+            "sequence_length": sequence_length,
+            "min_pitch": int(np.min(all_pitches)),
+            "max_pitch": int(np.max(all_pitches)),
+            "avg_pitch": float(np.mean(all_pitches)),
+            "total_notes": len(all_pitches)
+        }
+    finally:
+        # supprimé même si progress_callback lève (annulation): pas de fichier de la taille
+        # du corpus laissé dans output_dir. fermer le mapping avant (requis sous Windows)
+        del all_sequences
+        os.remove(all_path)
     
     stats_path = os.path.join(output_dir, "stats.txt")
     with open(stats_path, 'w') as f:
@@ -204,9 +450,15 @@ if __name__ == "__main__":
                         help="length of note sequences")
     parser.add_argument("--train_split", type=float, default=0.9,
                         help="proportion for training")
+    parser.add_argument("--num_workers", type=int, default=None,
+                        help="processes used to read midi files (default: all cores)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the train/validation shuffle")
     
     args = parser.parse_args()
     
+    logging.basicConfig(filename="preprocess_errors.log", level=logging.WARNING)
+    
     print(f"project folder: {PROJECT_DIR}")
     print(f"data folder: {args.data_dir}")
     print(f"output folder: {args.output_dir}\n")
@@ -215,6 +467,8 @@ if __name__ == "__main__":
         data_dir=args.data_dir,
         output_dir=args.output_dir,
         sequence_length=args.sequence_length,
-        train_split=args.train_split
+        train_split=args.train_split,
+        num_workers=args.num_workers,
+        seed=args.seed
     )
 
@@ -0,0 +1,74 @@
+import os
+import argparse
+from pathlib import Path
+
+import ijson
+from pymongo import MongoClient
+from pymongo.write_concern import WriteConcern
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROJECT_DIR = Path(__file__).parent.parent
+DATA_DIR = PROJECT_DIR / "data"
+
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "mugan_project")
+
+
+def inserer_json_mongodb(chemin_json: str, collection_name: str = "raw_data",
+                         batch_size: int = 1000, unacknowledged: bool = False) -> int:
+    """
+    chemin_json: fichier JSON contenant une liste de documents
+    collection_name: collection MongoDB de destination
+    batch_size: nombre de documents par insert_many
+    unacknowledged: écrire en w=0 sans attendre l'accusé de réception des lots
+                    (plus rapide, mais les erreurs d'insertion ne remontent pas)
+    Lit le JSON en flux (ijson) et insère par lots: la mémoire reste en
+    O(batch_size) quelle que soit la taille du fichier.
+    Retourne le nombre de documents insérés (envoyés si unacknowledged).
+    """
+    client = MongoClient(MONGODB_URL)
+    collection = client[MONGODB_DB_NAME][collection_name]
+    writer = collection.with_options(write_concern=WriteConcern(w=0)) if unacknowledged else collection
+    total = 0
+
+    try:
+        with open(chemin_json, 'rb') as f:
+            batch = []
+            # use_float: les nombres en Decimal ne sont pas encodables en BSON
+            for doc in ijson.items(f, 'item', use_float=True):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    writer.insert_many(batch, ordered=False)
+                    total += len(batch)
+                    batch.clear()
+            if batch:
+                writer.insert_many(batch, ordered=False)
+                total += len(batch)
+    finally:
+        client.close()
+
+    if unacknowledged:
+        # w=0: le serveur ne confirme rien, le nombre de documents réellement insérés est inconnu
+        print(f"Import into {MONGODB_DB_NAME}.{collection_name} sent unacknowledged (w=0), "
+              f"insert count not confirmed")
+    else:
+        print(f"{total} documents inserted into {MONGODB_DB_NAME}.{collection_name}")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a JSON dataset into MongoDB")
+    parser.add_argument("--json_path", type=str, default=str(DATA_DIR / "maestro_clean.json"),
+                        help="json file containing a list of documents")
+    parser.add_argument("--collection", type=str, default="raw_data",
+                        help="destination collection")
+    parser.add_argument("--batch_size", type=int, default=1000,
+                        help="documents per insert_many call")
+    parser.add_argument("--unacknowledged", action="store_true",
+                        help="write with w=0 (faster, insert errors are not reported)")
+
+    args = parser.parse_args()
+
+    inserer_json_mongodb(args.json_path, args.collection, args.batch_size, args.unacknowledged)
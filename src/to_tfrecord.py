@@ -0,0 +1,83 @@
+import os
+import argparse
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+
+PROJECT_DIR = Path(__file__).parent.parent
+PROCESSED_DIR = PROJECT_DIR / "data" / "processed"
+
+SPLITS = {
+    "train": "train_sequences.npy",
+    "validation": "validation_sequences.npy",
+}
+
+
+def sequence_example(sequence: np.ndarray) -> bytes:
+    """
+    sequence: séquence (sequence_length, 2) en uint8
+    Sérialise la séquence en tf.train.Example (octets bruts, relus avec tf.io.decode_raw).
+    """
+    feature = {
+        "sequence": tf.train.Feature(bytes_list=tf.train.BytesList(value=[sequence.tobytes()]))
+    }
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+def write_tfrecord_shards(sequences_path: str, output_dir: str, prefix: str, num_shards: int = 64) -> list:
+    """
+    sequences_path: fichier .npy produit par preprocess.py
+    output_dir: dossier de sortie des shards
+    prefix: préfixe des fichiers ("train" ou "validation")
+    num_shards: nombre de fichiers .tfrecord
+    Retourne la liste des shards écrits.
+    """
+    sequences = np.load(sequences_path, mmap_mode='r', allow_pickle=False)
+    if sequences.dtype != np.uint8:
+        sequences = np.where(sequences == -1, 128, sequences).astype(np.uint8)
+
+    num_shards = max(1, min(num_shards, len(sequences)))
+    bounds = np.linspace(0, len(sequences), num_shards + 1, dtype=np.int64)
+    paths = []
+
+    for shard in range(num_shards):
+        path = os.path.join(output_dir, f"{prefix}-{shard:05d}-of-{num_shards:05d}.tfrecord")
+        with tf.io.TFRecordWriter(path) as writer:
+            for sequence in sequences[bounds[shard]:bounds[shard + 1]]:
+                writer.write(sequence_example(np.ascontiguousarray(sequence)))
+        paths.append(path)
+
+    print(f"{prefix}: {len(sequences)} sequences written in {num_shards} shards")
+    return paths
+
+
+def convert_dataset(data_dir: str, num_shards: int = 64):
+    """
+    data_dir: dossier contenant train_sequences.npy et validation_sequences.npy
+    num_shards: nombre de shards pour le split d'entraînement (validation: num_shards // 8)
+    """
+    for prefix, filename in SPLITS.items():
+        sequences_path = os.path.join(data_dir, filename)
+        if not os.path.exists(sequences_path):
+            print(f"error: file not found: {sequences_path}")
+            print("   have you executed preprocess.py first?")
+            return
+
+        # supprimer les anciens shards (leur nombre a pu changer)
+        for old in tf.io.gfile.glob(os.path.join(data_dir, f"{prefix}-*.tfrecord")):
+            os.remove(old)
+
+        shards = num_shards if prefix == "train" else max(1, num_shards // 8)
+        write_tfrecord_shards(sequences_path, data_dir, prefix, shards)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert preprocessed sequences to TFRecord shards")
+    parser.add_argument("--data_dir", type=str, default=str(PROCESSED_DIR),
+                        help="folder containing preprocessed .npy data")
+    parser.add_argument("--num_shards", type=int, default=64,
+                        help="number of training shards")
+
+    args = parser.parse_args()
+
+    convert_dataset(args.data_dir, args.num_shards)
@@ -2,25 +2,50 @@ import os
 import json
 import argparse
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Callable, Optional
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
-import matplotlib.pyplot as plt
 
-# tf.config.set_visible_devices([], 'GPU')
-tf.data.experimental.enable_debug_mode()
 PROJECT_DIR = Path(__file__).parent.parent
 DATA_PROCESSED_DIR = PROJECT_DIR / "data" / "processed"
 MODELS_DIR = PROJECT_DIR / "models" / "music_vae"
 
+# allouer la mémoire GPU à la demande (sinon TF réserve toute la VRAM au démarrage)
+for gpu in tf.config.list_physical_devices('GPU'):
+    tf.config.experimental.set_memory_growth(gpu, True)
+
+# matmuls float32 (couches de sortie, ou toute la passe si la politique reste float32) sur
+# les tensor cores en TF32 (Ampere+; déjà le défaut de TF, rendu explicite)
+tf.config.experimental.enable_tensor_float_32_execution(True)
+
+# buffer de mélange des séquences lues depuis les shards TFRecord
+SHUFFLE_BUFFER = 100_000
+
+# au-delà, make_dataset lit les batches depuis le fichier mappé au lieu de tout copier en mémoire
+MAX_IN_MEMORY_BYTES = 2 * 1024 ** 3
+
+# checkpoint des meilleurs poids pendant l'entraînement
+BEST_WEIGHTS_FILE = 'best_model.weights.h5'
+
+# métriques par epoch enregistrées dans training_metrics.json
+METRIC_KEYS = [
+    'pitch_loss', 'pitch_accuracy', 'duration_loss', 'duration_accuracy',
+    'val_pitch_loss', 'val_pitch_accuracy', 'val_duration_loss', 'val_duration_accuracy'
+]
+
 
 class TrainingCallback(keras.callbacks.Callback):
-    def __init__(self, total_epochs: int, stats_callback: Optional[Callable] = None, start_time: float = None, should_stop: Optional[Callable] = None, on_complete: Optional[Callable] = None):
+    # métriques lues dans logs à chaque fin d'epoch
+    STAT_KEYS = ('loss', 'val_loss', *METRIC_KEYS)
+    
+    def __init__(self, total_epochs: int, stats_callback: Optional[Callable] = None, start_time: float = None, should_stop: Optional[Callable] = None, on_complete: Optional[Callable] = None, batch_size: int = 32):
         super().__init__()
         self.total_epochs = total_epochs
+        self.batch_size = batch_size
         self.stats_callback = stats_callback
         self.start_time = start_time or time.time()
         self.epoch_start_time = None
@@ -38,25 +63,23 @@ class TrainingCallback(keras.callbacks.Callback):
             epoch_time = time.time() - self.epoch_start_time
             eta = epoch_time * (self.total_epochs - epoch - 1)
             
+            metrics = {key: float(logs.get(key, 0)) for key in self.STAT_KEYS}
+            # lu sur l'optimiseur: logs['learning_rate'] (Keras 3) est écrit avant que
+            # ReduceLROnPlateau ne réduise le learning rate, il aurait une epoch de retard
+            learning_rate = self.model.optimizer.learning_rate.numpy()
+            
             stats = {
                 "epoch": epoch + 1,
                 "total_epochs": self.total_epochs,
-                "loss": float(logs.get('loss', 0)),
-                "accuracy": float(logs.get('pitch_accuracy', 0)),
-                "val_loss": float(logs.get('val_loss', 0)),
-                "val_accuracy": float(logs.get('val_pitch_accuracy', 0)),
-                "learning_rate": float(keras.backend.get_value(self.model.optimizer.lr)),
-                "batch_size": int(self.params.get('batch_size', 32)),
+                "loss": metrics['loss'],
+                "accuracy": metrics['pitch_accuracy'],
+                "val_loss": metrics['val_loss'],
+                "val_accuracy": metrics['val_pitch_accuracy'],
+                "learning_rate": float(learning_rate),
+                "batch_size": self.batch_size,
                 "time_elapsed": elapsed_time,
                 "eta": eta,
-                "pitch_loss": float(logs.get('pitch_loss', 0)),
-                "pitch_accuracy": float(logs.get('pitch_accuracy', 0)),
-                "duration_loss": float(logs.get('duration_loss', 0)),
-                "duration_accuracy": float(logs.get('duration_accuracy', 0)),
-                "val_pitch_loss": float(logs.get('val_pitch_loss', 0)),
-                "val_pitch_accuracy": float(logs.get('val_pitch_accuracy', 0)),
-                "val_duration_loss": float(logs.get('val_duration_loss', 0)),
-                "val_duration_accuracy": float(logs.get('val_duration_accuracy', 0))
+                **{key: metrics[key] for key in METRIC_KEYS}
             }
             
             self.stats_callback(stats)
@@ -69,40 +92,91 @@ class TrainingCallback(keras.callbacks.Callback):
             self.on_complete()
 
 
-def build_model(sequence_length: int, vocab_size: int = 128, learning_rate: float = 0.001) -> keras.Model:
+def cpu_supports_bfloat16() -> bool:
+    """
+    indique si le CPU calcule nativement en bfloat16 (AVX512-BF16 ou AMX), d'après /proc/cpuinfo.
+    """
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def select_precision_policy() -> str:
+    """
+    choisit la politique de précision Keras selon le matériel:
+    GPU -> mixed_float16 (compile() enveloppe Adam dans un LossScaleOptimizer),
+    CPU avec bfloat16 natif -> mixed_bfloat16, sinon float32 (le float16 est lent sur CPU).
+    """
+    if tf.config.list_physical_devices('GPU'):
+        return 'mixed_float16'
+    if cpu_supports_bfloat16():
+        return 'mixed_bfloat16'
+    return 'float32'
+
+
+def build_model(sequence_length: int, vocab_size: int = 128, learning_rate: float = 0.001,
+                lstm_layers: int = 2) -> keras.Model:
     """
     2 sorties: pitch et duration.
     sequence_length: longueur des séquences d'entrée
     vocab_size: nombre de notes uniques (0-127 pour MIDI)
     learning_rate: learning rate pour l'optimiseur Adam
+    lstm_layers: 2 = LSTM 128 -> LSTM 64, 1 = un seul LSTM 128 (environ moitié moins de calcul récurrent)
     """
-    inputs = keras.Input(shape=(sequence_length, 2))
-    
-    x = layers.LSTM(128, return_sequences=True)(inputs)
-    x = layers.Dropout(0.2)(x)
-    
-    x = layers.LSTM(64, return_sequences=False)(x)
+    # entrées entières (uint8, comme sur disque): 4x moins d'octets dans le pipeline.
+    # pitch et duration sont des classes: une table d'embedding par canal au lieu des
+    # valeurs brutes en flottant (canaux séparés par Permute + Cropping1D, sérialisables)
+    inputs = keras.Input(shape=(sequence_length, 2), dtype='uint8')
+    channels = layers.Permute((2, 1))(inputs)
+    pitch_ids = layers.Reshape((sequence_length,))(layers.Cropping1D((0, 1))(channels))
+    duration_ids = layers.Reshape((sequence_length,))(layers.Cropping1D((1, 0))(channels))
+    
+    # vocab_size + 2 lignes: pitches 0-127, padding 128 (et 129 réservé comme pour la sortie)
+    pitch_embedding = layers.Embedding(vocab_size + 2, 32, name='pitch_embedding')(pitch_ids)
+    duration_embedding = layers.Embedding(5, 4, name='duration_embedding')(duration_ids)
+    x = layers.Concatenate()([pitch_embedding, duration_embedding])
+    
+    # signature compatible cuDNN (tanh/sigmoid, pas de recurrent_dropout, pas d'unroll):
+    # le dropout entre les deux LSTM passe par l'argument dropout de la seconde
+    cudnn_args = dict(activation='tanh', recurrent_activation='sigmoid', use_bias=True,
+                      unit_forget_bias=True, recurrent_dropout=0.0, unroll=False)
+    if lstm_layers == 1:
+        x = layers.LSTM(128, return_sequences=False, **cudnn_args)(x)
+    else:
+        x = layers.LSTM(128, return_sequences=True, **cudnn_args)(x)
+        x = layers.LSTM(64, return_sequences=False, dropout=0.2, **cudnn_args)(x)
     x = layers.Dropout(0.2)(x)
     
     x = layers.Dense(128, activation='relu')(x)
     x = layers.Dropout(0.2)(x)
     x = layers.Dense(64, activation='relu')(x)
     
-    pitch_output = layers.Dense(vocab_size + 2, activation='softmax', name='pitch')(x)
-    duration_output = layers.Dense(5, activation='softmax', name='duration')(x)
+    # sorties en float32 même en mixed precision; logits bruts, le softmax est fusionné
+    # dans la loss (from_logits) et appliqué par generate.py à l'inférence
+    pitch_output = layers.Dense(vocab_size + 2, name='pitch', dtype='float32')(x)
+    duration_output = layers.Dense(5, name='duration', dtype='float32')(x)
     
     model = keras.Model(inputs=inputs, outputs=[pitch_output, duration_output])
     
     model.compile(
         optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
         loss={
-            'pitch': 'sparse_categorical_crossentropy',
-            'duration': 'sparse_categorical_crossentropy'
+            'pitch': keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+            'duration': keras.losses.SparseCategoricalCrossentropy(from_logits=True)
         },
         metrics={
             'pitch': 'accuracy',
             'duration': 'accuracy'
-        }
+        },
+        # plusieurs batches par appel de la fonction compilée: moins d'allers-retours Python
+        # par step (les callbacks par epoch ne sont pas affectés)
+        steps_per_execution=32
+        # pas de jit_compile: sur GPU les LSTM passent par cuDNN, que XLA ne compile pas
+        # (Keras 3 désactive alors XLA pour tout le modèle, avec un avertissement); sur CPU la
+        # compilation XLA de la boucle LSTM est bien plus lente que l'exécution
     )
     
     return model
@@ -110,29 +184,148 @@ def build_model(sequence_length: int, vocab_size: int = 128, learning_rate: floa
 
 def prepare_data(sequences: np.ndarray, sequence_length: int):
     """
-    sépare pitch et duration et crée des paires (input, target).
+    crée les paires (input, target): target = [pitch, duration] du dernier pas.
     sequences: array de séquences (num_sequences, sequence_length, 2)
     sequence_length: longueur des séquences
     """
-    X = []
-    y_pitch = []
-    y_duration = []
-    
-    for seq in sequences:
-        X.append(seq)
-        y_pitch.append(int(seq[-1, 0]))
-        y_duration.append(int(seq[-1, 1]))
-    
-    X = np.array(X, dtype=np.float32)
-    y_pitch = np.array(y_pitch, dtype=np.int32)
-    y_duration = np.array(y_duration, dtype=np.int32)
+    if np.issubdtype(sequences.dtype, np.unsignedinteger):
+        # fichiers uint8: pas de padding -1, X reste la vue mmap (copiée une fois par tf.data)
+        X = sequences
+    else:
+        # anciens fichiers signés: une seule copie contiguë en int32, padding -1 remplacé
+        # en place par la convention uint8 (pitch 128, duration 0) attendue par les embeddings
+        X = np.array(sequences, dtype=np.int32, order='C')
+        np.putmask(X[..., 0], X[..., 0] == -1, 128)
+        np.maximum(X[..., 1], 0, out=X[..., 1])
+    
+    # cibles [pitch, duration] dans un seul tableau uint8 (pitch <= 128, duration <= 4),
+    # séparées par batch dans le graphe; la loss accepte directement des entiers uint8
+    y = X[:, -1].astype(np.uint8)
+    
+    return X, y
+
+
+def split_targets(X, y):
+    """
+    sépare les cibles (batch, 2) en un dict par sortie du modèle (op tf.data, dans le graphe).
+    """
+    return X, {'pitch': y[:, 0], 'duration': y[:, 1]}
+
+
+def dataset_options(training: bool = True) -> tf.data.Options:
+    """
+    options tf.data communes aux pipelines npy et TFRecord.
+    training: ordre des éléments libre (déjà mélangés), sinon ordre conservé
+    """
+    options = tf.data.Options()
+    options.deterministic = not training
+    # fusion map+batch, map et batch parallélisés, suppression des opérations inutiles
+    options.experimental_optimization.map_and_batch_fusion = True
+    options.experimental_optimization.map_parallelization = True
+    options.experimental_optimization.parallel_batch = True
+    options.experimental_optimization.noop_elimination = True
+    # pool de threads dédié au pipeline
+    options.threading.private_threadpool_size = os.cpu_count() or 1
+    return options
+
+
+def make_dataset(X: np.ndarray, y: np.ndarray, batch_size: int, training: bool = True) -> tf.data.Dataset:
+    """
+    construit le pipeline tf.data (cache, mélange, batch, prefetch) pour model.fit.
+    X: entrées (num_sequences, sequence_length, 2)
+    y: cibles (num_sequences, 2) [pitch, duration]
+    batch_size: taille des batches
+    training: mélange à chaque epoch et batches complets (sinon ordre conservé)
+    """
+    # batches de taille fixe à l'entraînement, sauf si le dataset est plus petit qu'un batch
+    drop_remainder = training and len(X) >= batch_size
+    
+    if X.nbytes <= MAX_IN_MEMORY_BYTES:
+        ds = tf.data.Dataset.from_tensor_slices((X, y))
+        ds = ds.cache()
+        if training:
+            # fit() ne mélange plus lui-même un Dataset: buffer = dataset entier
+            ds = ds.shuffle(len(X), reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size, drop_remainder=drop_remainder)
+    else:
+        # corpus plus gros que la RAM: on ne mélange que les indices et chaque batch
+        # est lu depuis le fichier mappé (X reste une vue mmap, jamais chargée en entier)
+        def read_batch(indices):
+            indices = np.sort(indices)  # lecture séquentielle dans le fichier
+            return X[indices], y[indices]
+        
+        def load_batch(indices):
+            X_batch, y_batch = tf.numpy_function(read_batch, [indices], [tf.as_dtype(X.dtype), tf.uint8])
+            X_batch.set_shape((None,) + X.shape[1:])
+            y_batch.set_shape((None, 2))
+            return X_batch, y_batch
+        
+        ds = tf.data.Dataset.range(len(X))
+        if training:
+            ds = ds.shuffle(len(X), reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size, drop_remainder=drop_remainder)
+        ds = ds.map(load_batch, num_parallel_calls=tf.data.AUTOTUNE)
     
-    X = np.where(X == -1, 128, X)
-    X = np.where(X == 0, 0, X).astype(np.float32)
-    y_pitch = np.where(y_pitch == -1, 128, y_pitch).astype(np.int32)
-    y_duration = np.where(y_duration <= 0, 0, y_duration).astype(np.int32)
+    ds = ds.map(split_targets, num_parallel_calls=tf.data.AUTOTUNE)
+    ds = ds.with_options(dataset_options(training))
     
-    return X, y_pitch, y_duration
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+def tfrecord_shards(train_dir: str, prefix: str, npy_path: str) -> list:
+    """
+    retourne les shards <prefix>-*.tfrecord de train_dir, ou [] s'il n'y en a pas
+    ou s'ils sont plus anciens que le .npy (prétraitement relancé depuis la conversion).
+    train_dir: dossier contenant les données prétraitées
+    prefix: "train" ou "validation"
+    npy_path: fichier .npy correspondant
+    """
+    shards = sorted(tf.io.gfile.glob(os.path.join(train_dir, f"{prefix}-*.tfrecord")))
+    if shards and min(os.path.getmtime(shard) for shard in shards) < os.path.getmtime(npy_path):
+        print(f"warning: {prefix} tfrecord shards are older than {os.path.basename(npy_path)}, ignored")
+        return []
+    return shards
+
+
+def load_tfrecord_dataset(shards: list, sequence_length: int, batch_size: int,
+                          training: bool = True, num_sequences: Optional[int] = None) -> tf.data.Dataset:
+    """
+    construit le pipeline tf.data depuis les shards écrits par to_tfrecord.py.
+    shards: fichiers .tfrecord
+    sequence_length: longueur des séquences
+    batch_size: taille des batches
+    training: mélange des fichiers et des séquences, lecture non déterministe
+    num_sequences: nombre de séquences dans les shards; fixe la cardinalité du dataset
+                   (nécessaire à fit() avec steps_per_execution > 1)
+    """
+    feature_spec = {'sequence': tf.io.FixedLenFeature([], tf.string)}
+    
+    def parse(record):
+        example = tf.io.parse_single_example(record, feature_spec)
+        sequence = tf.reshape(tf.io.decode_raw(example['sequence'], tf.uint8), [sequence_length, 2])
+        target = sequence[-1]
+        return sequence, {'pitch': target[0], 'duration': target[1]}
+    
+    files = tf.data.Dataset.from_tensor_slices(shards)
+    if training:
+        files = files.shuffle(len(shards), reshuffle_each_iteration=True)
+    
+    ds = files.interleave(tf.data.TFRecordDataset, cycle_length=16,
+                          num_parallel_calls=tf.data.AUTOTUNE, deterministic=not training)
+    ds = ds.map(parse, num_parallel_calls=tf.data.AUTOTUNE)
+    
+    # batches complets à l'entraînement, sauf si le dataset est plus petit qu'un batch
+    drop_remainder = training and (num_sequences is None or num_sequences >= batch_size)
+    if training:
+        ds = ds.shuffle(SHUFFLE_BUFFER, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size, drop_remainder=drop_remainder)
+    
+    if num_sequences is not None:
+        num_batches = num_sequences // batch_size if drop_remainder else -(-num_sequences // batch_size)
+        ds = ds.apply(tf.data.experimental.assert_cardinality(num_batches))
+    ds = ds.with_options(dataset_options(training))
+    
+    return ds.prefetch(tf.data.AUTOTUNE)
 
 
 def save_metrics_json(history, model_dir: str, num_epochs: int, batch_size: int, learning_rate: float = 0.001):
@@ -147,35 +340,21 @@ def save_metrics_json(history, model_dir: str, num_epochs: int, batch_size: int,
     """
     metrics_path = os.path.join(model_dir, "training_metrics.json")
     
+    # conversion vectorisée en floats Python (sérialisables en JSON), une passe par métrique
+    series = {key: np.asarray(history.history.get(key, []), dtype=np.float64).tolist() for key in METRIC_KEYS}
+    
     metrics = {
         "num_epochs": num_epochs,
         "batch_size": batch_size,
         "learning_rate": learning_rate,
-        "pitch_loss": history.history.get('pitch_loss', []),
-        "pitch_accuracy": history.history.get('pitch_accuracy', []),
-        "duration_loss": history.history.get('duration_loss', []),
-        "duration_accuracy": history.history.get('duration_accuracy', []),
-        "val_pitch_loss": history.history.get('val_pitch_loss', []),
-        "val_pitch_accuracy": history.history.get('val_pitch_accuracy', []),
-        "val_duration_loss": history.history.get('val_duration_loss', []),
-        "val_duration_accuracy": history.history.get('val_duration_accuracy', []),
+        **series,
         "final_metrics": {
-            "pitch_loss": float(history.history['pitch_loss'][-1]),
-            "pitch_accuracy": float(history.history['pitch_accuracy'][-1]),
-            "duration_loss": float(history.history['duration_loss'][-1]),
-            "duration_accuracy": float(history.history['duration_accuracy'][-1]),
-            "val_pitch_loss": float(history.history['val_pitch_loss'][-1]),
-            "val_pitch_accuracy": float(history.history['val_pitch_accuracy'][-1]),
-            "val_duration_loss": float(history.history['val_duration_loss'][-1]),
-            "val_duration_accuracy": float(history.history['val_duration_accuracy'][-1]),
-            "epochs_trained": len(history.history['pitch_loss'])
+            # dernière valeur lue dans les listes déjà converties (0.0 si la métrique manque)
+            **{key: values[-1] if values else 0.0 for key, values in series.items()},
+            "epochs_trained": len(series['pitch_loss'])
         }
     }
     
-    for key in metrics:
-        if isinstance(metrics[key], list):
-            metrics[key] = [float(x) for x in metrics[key]]
-    
     with open(metrics_path, 'w') as f:
         json.dump(metrics, f, indent=2)
     
@@ -184,6 +363,62 @@ def save_metrics_json(history, model_dir: str, num_epochs: int, batch_size: int,
     return metrics_path
 
 
+def save_best_model(model: keras.Model, model_dir: str):
+    """
+    recharge les meilleurs poids sauvegardés par ModelCheckpoint et écrit best_model.keras
+    (modèle complet, utilisé par generate.py). à appeler après la sauvegarde de model_final.
+    model: modèle entraîné (ses poids sont remplacés par les meilleurs)
+    model_dir: dossier du modèle
+    """
+    weights_path = os.path.join(model_dir, BEST_WEIGHTS_FILE)
+    if not os.path.exists(weights_path):
+        return
+    
+    model.load_weights(weights_path)
+    best_model_path = os.path.join(model_dir, 'best_model.keras')
+    model.save(best_model_path)
+    print(f"best model saved: {best_model_path}")
+
+
+def save_plot(history, graph_path: str):
+    """
+    trace les courbes de loss et d'accuracy (pitch et duration).
+    utilise une Figure dédiée (pas l'état global de pyplot) pour pouvoir tourner dans un thread.
+    matplotlib n'est importé qu'ici: son import ne pèse pas sur le démarrage de l'entraînement.
+    history: objet History retourné par model.fit()
+    graph_path: chemin de l'image PNG
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    fig = Figure(figsize=(12, 4))
+    FigureCanvasAgg(fig)
+    
+    ax = fig.add_subplot(1, 2, 1)
+    ax.plot(history.history['pitch_loss'], label='Training Pitch Loss')
+    ax.plot(history.history['val_pitch_loss'], label='Validation Pitch Loss')
+    ax.plot(history.history['duration_loss'], label='Training Duration Loss')
+    ax.plot(history.history['val_duration_loss'], label='Validation Duration Loss')
+    ax.set_title('Loss during training')
+    ax.set_xlabel('Epoch')
+    ax.set_ylabel('Loss')
+    ax.legend()
+    ax.grid(True)
+    
+    ax = fig.add_subplot(1, 2, 2)
+    ax.plot(history.history['pitch_accuracy'], label='Training Pitch Accuracy')
+    ax.plot(history.history['val_pitch_accuracy'], label='Validation Pitch Accuracy')
+    ax.plot(history.history['duration_accuracy'], label='Training Duration Accuracy')
+    ax.plot(history.history['val_duration_accuracy'], label='Validation Duration Accuracy')
+    ax.set_title('Accuracy during training')
+    ax.set_xlabel('Epoch')
+    ax.set_ylabel('Accuracy')
+    ax.legend()
+    ax.grid(True)
+    
+    fig.savefig(graph_path, dpi=100, bbox_inches='tight')
+    print(f"graphs saved: {graph_path}")
+
 
 def train_model(train_dir: str,
                 model_dir: str,
@@ -193,7 +428,9 @@ def train_model(train_dir: str,
                 learning_rate: float = 0.001,
                 stats_callback: Optional[Callable] = None,
                 should_stop: Optional[Callable] = None,
-                on_train_complete: Optional[Callable] = None):
+                on_train_complete: Optional[Callable] = None,
+                plot: bool = True,
+                lstm_layers: int = 2):
     """
     train_dir: dossier contenant les données prétraitées
     model_dir: dossier pour sauvegarder le modèle
@@ -204,6 +441,8 @@ def train_model(train_dir: str,
     stats_callback: fonction appelée à chaque epoch avec les statistiques
     should_stop: fonction qui retourne True si l'entraînement doit être arrêté
     on_train_complete: fonction appelée à la fin de l'entraînement (y compris avec early stopping)
+    plot: générer training_history.png (les métriques restent dans training_log.csv et training_metrics.json)
+    lstm_layers: nombre de couches LSTM du modèle (1 ou 2, voir build_model)
     """
     os.makedirs(model_dir, exist_ok=True)
     start_time = time.time()
@@ -221,40 +460,84 @@ def train_model(train_dir: str,
         print("   have you executed preprocess.py first?")
         return
     
-    train_sequences = np.load(train_path)
-    val_sequences = np.load(val_path)
-    
-    print(f"training data loaded: {train_sequences.shape}")
-    print(f"validation data loaded: {val_sequences.shape}")
-    
-    print("\ndata preparation...")
-    X_train, y_pitch_train, y_duration_train = prepare_data(train_sequences, sequence_length)
-    X_val, y_pitch_val, y_duration_val = prepare_data(val_sequences, sequence_length)
+    train_shards = tfrecord_shards(train_dir, "train", train_path)
+    val_shards = tfrecord_shards(train_dir, "validation", val_path)
+    
+    if train_shards and val_shards:
+        # shards produits par to_tfrecord.py: lecture parallèle, sans charger le .npy
+        print(f"training data: {len(train_shards)} tfrecord shards")
+        print(f"validation data: {len(val_shards)} tfrecord shards")
+        # nombre de séquences lu dans l'en-tête des .npy (shards plus récents, donc identiques)
+        num_train = np.load(train_path, mmap_mode='r', allow_pickle=False).shape[0]
+        num_val = np.load(val_path, mmap_mode='r', allow_pickle=False).shape[0]
+        train_ds = load_tfrecord_dataset(train_shards, sequence_length, batch_size, training=True,
+                                         num_sequences=num_train)
+        steps_per_epoch = None
+        val_ds = load_tfrecord_dataset(val_shards, sequence_length, batch_size, training=False,
+                                       num_sequences=num_val)
+    else:
+        # mmap: les séquences sont lues depuis le disque au fil de prepare_data, sans copie préalable
+        train_sequences = np.load(train_path, mmap_mode='r', allow_pickle=False)
+        val_sequences = np.load(val_path, mmap_mode='r', allow_pickle=False)
+        
+        print(f"training data loaded: {train_sequences.shape}")
+        print(f"validation data loaded: {val_sequences.shape}")
+        
+        print("\ndata preparation...")
+        X_train, y_train = prepare_data(train_sequences, sequence_length)
+        X_val, y_val = prepare_data(val_sequences, sequence_length)
+        
+        print(f"X_train shape: {X_train.shape}")
+        print(f"y_train shape: {y_train.shape}")
+        
+        train_ds = make_dataset(X_train, y_train, batch_size, training=True)
+        # batches complets (drop_remainder): forme statique, un seul tracing du graphe
+        steps_per_epoch = max(len(X_train) // batch_size, 1)
+        val_ds = make_dataset(X_val, y_val, batch_size, training=False)
     
-    print(f"X_train shape: {X_train.shape}")
-    print(f"y_pitch_train shape: {y_pitch_train.shape}")
-    print(f"y_duration_train shape: {y_duration_train.shape}")
+    policy = select_precision_policy()
+    keras.mixed_precision.set_global_policy(policy)
+    if policy != 'float32':
+        print(f"mixed precision enabled: {policy}")
     
     print("\nmodel building...")
-    model = build_model(sequence_length, learning_rate=learning_rate)
+    model = build_model(sequence_length, learning_rate=learning_rate, lstm_layers=lstm_layers)
     print("model built")
     
     print("\nmodel summary:")
     model.summary()
     
+    # poids d'un entraînement précédent (architecture éventuellement différente):
+    # save_best_model ne doit recharger que ceux écrits par cet entraînement
+    best_weights_path = os.path.join(model_dir, BEST_WEIGHTS_FILE)
+    if os.path.exists(best_weights_path):
+        os.remove(best_weights_path)
+    
     # Callbacks
     callbacks_list = [
+        # poids seuls à chaque amélioration (rapide); best_model.keras est écrit une fois à la fin
         keras.callbacks.ModelCheckpoint(
-            os.path.join(model_dir, 'best_model.h5'),
+            best_weights_path,
             monitor='val_loss',
             save_best_only=True,
+            save_weights_only=True,
             verbose=1
         ),
         keras.callbacks.EarlyStopping(
             monitor='val_loss',
             patience=3,
             verbose=1
-        )
+        ),
+        # divise le learning rate avant que EarlyStopping n'arrête l'entraînement
+        keras.callbacks.ReduceLROnPlateau(
+            monitor='val_loss',
+            factor=0.5,
+            patience=2,
+            min_lr=1e-6,
+            verbose=1
+        ),
+        # une ligne par epoch, écrite au fil de l'entraînement (conservée si interrompu)
+        keras.callbacks.CSVLogger(os.path.join(model_dir, 'training_log.csv'))
     ]
     
     if stats_callback:
@@ -263,7 +546,8 @@ def train_model(train_dir: str,
             stats_callback=stats_callback,
             start_time=start_time,
             should_stop=should_stop,
-            on_complete=on_train_complete
+            on_complete=on_train_complete,
+            batch_size=batch_size
         )
         callbacks_list.append(training_cb)
     
@@ -274,58 +558,36 @@ def train_model(train_dir: str,
     
     try:
         history = model.fit(
-            X_train, {'pitch': y_pitch_train, 'duration': y_duration_train},
+            train_ds,
             epochs=num_epochs,
-            batch_size=batch_size,
-            validation_data=(X_val, {'pitch': y_pitch_val, 'duration': y_duration_val}),
+            steps_per_epoch=steps_per_epoch,
+            validation_data=val_ds,
             callbacks=callbacks_list,
             verbose=2
         )
     except KeyboardInterrupt:
         print("\ntraining interrupted by user")
+        save_best_model(model, model_dir)
         return None
     
     # save model
-    final_model_path = os.path.join(model_dir, 'model_final.h5')
+    final_model_path = os.path.join(model_dir, 'model_final.keras')
     model.save(final_model_path)
     print(f"\nmodele sauvegardé {final_model_path}")
-    
-    # save architecture
-    with open(os.path.join(model_dir, 'model_config.json'), 'w') as f:
-        f.write(model.to_json())
-    
-    # plot training curves
-    print("\ngraph gen")
-    plt.figure(figsize=(12, 4))
-    
-    plt.subplot(1, 2, 1)
-    plt.plot(history.history['pitch_loss'], label='Training Pitch Loss')
-    plt.plot(history.history['val_pitch_loss'], label='Validation Pitch Loss')
-    plt.plot(history.history['duration_loss'], label='Training Duration Loss')
-    plt.plot(history.history['val_duration_loss'], label='Validation Duration Loss')
-    plt.title('Loss during training')
-    plt.xlabel('Epoch')
-    plt.ylabel('Loss')
-    plt.legend()
-    plt.grid(True)
-    
-    plt.subplot(1, 2, 2)
-    plt.plot(history.history['pitch_accuracy'], label='Training Pitch Accuracy')
-    plt.plot(history.history['val_pitch_accuracy'], label='Validation Pitch Accuracy')
-    plt.plot(history.history['duration_accuracy'], label='Training Duration Accuracy')
-    plt.plot(history.history['val_duration_accuracy'], label='Validation Duration Accuracy')
-    plt.title('Accuracy during training')
-    plt.xlabel('Epoch')
-    plt.ylabel('Accuracy')
-    plt.legend()
-    plt.grid(True)
-    
-    graph_path = os.path.join(model_dir, 'training_history.png')
-    plt.savefig(graph_path, dpi=100, bbox_inches='tight')
-    print(f"graphs saved: {graph_path}")
-    
-    print("\nmetrics saving...")
-    save_metrics_json(history, model_dir, num_epochs, batch_size, learning_rate)
+    save_best_model(model, model_dir)
+    
+    if plot:
+        # courbes et métriques écrites en parallèle
+        print("\ngraph gen and metrics saving...")
+        graph_path = os.path.join(model_dir, 'training_history.png')
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            plot_future = executor.submit(save_plot, history, graph_path)
+            metrics_future = executor.submit(save_metrics_json, history, model_dir, num_epochs, batch_size, learning_rate)
+            plot_future.result()
+            metrics_future.result()
+    else:
+        print("\nmetrics saving...")
+        save_metrics_json(history, model_dir, num_epochs, batch_size, learning_rate)
     
     print("\n" + "=" * 60)
     print("training complete!")
@@ -347,9 +609,18 @@ if __name__ == "__main__":
                         help="sequence length")
     parser.add_argument("--learning_rate", type=float, default=0.001,
                         help="learning rate for Adam optimizer")
+    parser.add_argument("--lstm_layers", type=int, choices=[1, 2], default=2,
+                        help="number of stacked LSTM layers (1 is faster)")
+    parser.add_argument("--no_plot", action="store_true",
+                        help="skip training_history.png (metrics are still saved as csv and json)")
+    parser.add_argument("--debug", action="store_true",
+                        help="run tf.data eagerly to diagnose dataset bugs (disables all input pipeline optimizations)")
     
     args = parser.parse_args()
     
+    if args.debug:
+        tf.data.experimental.enable_debug_mode()
+    
     print(f"project folder: {PROJECT_DIR}")
     print(f"training data: {args.train_dir}")
     print(f"models: {args.model_dir}\n")
@@ -360,6 +631,8 @@ if __name__ == "__main__":
         num_epochs=args.num_epochs,
         batch_size=args.batch_size,
         sequence_length=args.sequence_length,
-        learning_rate=args.learning_rate
+        learning_rate=args.learning_rate,
+        plot=not args.no_plot,
+        lstm_layers=args.lstm_layers
     )
 
@@ -0,0 +1,58 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import generate
+from train import build_model
+
+
+def _save_fresh_model(tmp_path):
+    model = build_model(32)
+    model_path = str(tmp_path / "best_model.keras")
+    model.save(model_path)
+    return model, model_path
+
+
+def test_export_round_trip(tmp_path):
+    model, model_path = _save_fresh_model(tmp_path)
+
+    loaded = generate.load_model(model_path)
+
+    assert (tmp_path / "best_model_sm" / "saved_model.pb").exists()
+    assert not (tmp_path / "best_model_sm.failed").exists()
+    assert not isinstance(loaded, generate.InferenceModule)
+
+    events = generate.create_random_seed_sequence(32, num_samples=3)
+    pitch, duration = loaded(events)
+    expected_pitch, expected_duration = model(events.astype(np.uint8), training=False)
+
+    np.testing.assert_allclose(pitch, tf.nn.softmax(expected_pitch), atol=1e-5)
+    np.testing.assert_allclose(duration, tf.nn.softmax(expected_duration), atol=1e-5)
+
+    # second load restores the exported graph without exporting again
+    mtime = (tmp_path / "best_model_sm" / "saved_model.pb").stat().st_mtime
+    generate.load_model(model_path)
+    assert (tmp_path / "best_model_sm" / "saved_model.pb").stat().st_mtime == mtime
+
+
+def test_failed_export_is_not_retried(tmp_path, monkeypatch):
+    _, model_path = _save_fresh_model(tmp_path)
+    calls = []
+
+    def failing_export(model, export_dir):
+        calls.append(export_dir)
+        raise RuntimeError("export failed")
+
+    monkeypatch.setattr(generate, "export_saved_model", failing_export)
+
+    first = generate.load_model(model_path)
+    second = generate.load_model(model_path)
+
+    assert isinstance(first, generate.InferenceModule)
+    assert isinstance(second, generate.InferenceModule)
+    assert len(calls) == 1
+    assert (tmp_path / "best_model_sm.failed").exists()
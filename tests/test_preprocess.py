@@ -0,0 +1,101 @@
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import preprocess
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def test_parse_midi_groups_chords_like_music21():
+    # chords.mid (480 ticks per quarter, one 4/4 track):
+    # - C4 E4 G4 rolled over 30 ticks, same end: one chord
+    # - C3 E3 G3 at 960, 1065 and 1160 ticks: G3 is 200 ticks after the chord's first note,
+    #   beyond the 120-tick window, so it opens its own chord at 29/12 (ties go to the 1/4 grid)
+    # - C5 and C4 5 ticks apart but ending 1 quarter apart: two separate notes
+    # - a 10-tick G#5 that would quantize to a zero duration
+    # - a drum note on channel 10, ignored
+    pitches, offsets, durations, velocities = preprocess._parse_midi(str(DATA_DIR / "chords.mid"))
+
+    np.testing.assert_array_equal(pitches, [60, 48, 55, 72, 60, 80])
+    np.testing.assert_allclose(offsets, [0.0, 2.0, 2.5, 4.0, 4.0, 6.0])
+    np.testing.assert_allclose(durations, [1.0, 0.5, 0.25, 1.0, 2.0, 0.25])
+    np.testing.assert_array_equal(velocities, 80)
+
+
+def _counting_parser(monkeypatch):
+    calls = []
+    parse = preprocess._parse_midi
+
+    def counting_parse(midi_path):
+        calls.append(midi_path)
+        return parse(midi_path)
+
+    monkeypatch.setattr(preprocess, "_parse_midi", counting_parse)
+    return calls
+
+
+def _cached_copy(tmp_path):
+    midi_path = tmp_path / "chords.mid"
+    midi_path.write_bytes((DATA_DIR / "chords.mid").read_bytes())
+    return str(midi_path), tmp_path / "cache"
+
+
+def test_cache_hit_skips_parsing(tmp_path, monkeypatch):
+    midi_path, cache_dir = _cached_copy(tmp_path)
+    calls = _counting_parser(monkeypatch)
+
+    first = preprocess.extract_notes_from_midi(midi_path, cache_dir)
+    second = preprocess.extract_notes_from_midi(midi_path, cache_dir)
+
+    assert len(calls) == 1
+    for cached, parsed in zip(second, first):
+        np.testing.assert_array_equal(cached, parsed)
+
+
+def test_cache_miss_after_touch(tmp_path, monkeypatch):
+    midi_path, cache_dir = _cached_copy(tmp_path)
+    calls = _counting_parser(monkeypatch)
+
+    preprocess.extract_notes_from_midi(midi_path, cache_dir)
+    cache = preprocess._cache_path(midi_path, cache_dir)
+    newer = cache.stat().st_mtime + 10
+    os.utime(midi_path, (newer, newer))
+    preprocess.extract_notes_from_midi(midi_path, cache_dir)
+
+    assert len(calls) == 2
+
+
+def test_cache_miss_after_version_bump(tmp_path, monkeypatch):
+    midi_path, cache_dir = _cached_copy(tmp_path)
+    calls = _counting_parser(monkeypatch)
+
+    preprocess.extract_notes_from_midi(midi_path, cache_dir)
+    monkeypatch.setattr(preprocess, "EXTRACTOR_VERSION", preprocess.EXTRACTOR_VERSION + 1)
+    preprocess.extract_notes_from_midi(midi_path, cache_dir)
+    preprocess.extract_notes_from_midi(midi_path, cache_dir)
+
+    # the stale cache is parsed again once, then rewritten with the new version
+    assert len(calls) == 2
+    with np.load(preprocess._cache_path(midi_path, cache_dir)) as cached:
+        assert int(cached["version"]) == preprocess.EXTRACTOR_VERSION
+
+
+def test_write_split_matches_fancy_indexing(tmp_path):
+    rng = np.random.default_rng(0)
+    sequences = rng.integers(0, 129, (50, 32, 2)).astype(np.uint8)
+    permutation = rng.permutation(len(sequences))
+
+    for name, indices in (("train", permutation[:40]), ("validation", permutation[40:]),
+                          ("empty", permutation[:0])):
+        path = str(tmp_path / f"{name}.npy")
+        # chunk_size smaller than the split to cover several chunks and a partial last one
+        preprocess.write_split(sequences, indices, path, chunk_size=7)
+
+        split = np.load(path)
+        assert split.dtype == sequences.dtype
+        np.testing.assert_array_equal(split, sequences[indices])
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import train
+
+
+def test_stats_report_reduced_learning_rate():
+    rng = np.random.default_rng(0)
+    sequences = rng.integers(0, 5, (64, 32, 2)).astype(np.uint8)
+    X, y = train.prepare_data(sequences, 32)
+    model = train.build_model(32, learning_rate=0.001)
+    stats = []
+
+    callbacks = [
+        # forced plateau: from the second epoch on, no improvement beats min_delta
+        train.keras.callbacks.ReduceLROnPlateau(monitor='loss', factor=0.5, patience=0, min_delta=1e9),
+        train.TrainingCallback(total_epochs=3, stats_callback=stats.append),
+    ]
+    model.fit(train.make_dataset(X, y, 16), epochs=3, verbose=0, callbacks=callbacks)
+
+    learning_rates = [s["learning_rate"] for s in stats]
+    np.testing.assert_allclose(learning_rates, [0.001, 0.0005, 0.00025], rtol=1e-6)
+    np.testing.assert_allclose(learning_rates[-1], model.optimizer.learning_rate.numpy(), rtol=1e-6)